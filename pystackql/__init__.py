@@ -1,3 +1,11 @@
 from .stackql import StackQL
-from .magic import StackqlMagic
-from .magics import StackqlServerMagic
\ No newline at end of file
+
+def __getattr__(name):
+    # the Jupyter magics import IPython, so load them only when they are used
+    if name == 'StackqlMagic':
+        from .magic import StackqlMagic
+        return StackqlMagic
+    if name == 'StackqlServerMagic':
+        from .magics import StackqlServerMagic
+        return StackqlServerMagic
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
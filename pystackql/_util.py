@@ -58,6 +58,24 @@ def _get_url():
     else:
         raise Exception(f"ERROR: [_get_url] unsupported OS type: {system_val} {machine_val}")
 
+def _get_etag_path(download_dir):
+	return os.path.join(download_dir, '.stackql_etag')
+
+def _is_latest(download_dir):
+	"""Checks if the release archive the local binary was installed from is still the latest one."""
+	etag_path = _get_etag_path(download_dir)
+	if not os.path.exists(etag_path):
+		return False
+	with open(etag_path) as f:
+		local_etag = f.read().strip()
+	try:
+		r = requests.head(_get_url(), allow_redirects=True, headers={'If-None-Match': local_etag}, timeout=10)
+	except Exception:
+		return False
+	if r.status_code == 304:
+		return True
+	return r.ok and r.headers.get('ETag') == local_etag
+
 def _download_file(url, path, showprogress=True):
 	try:
 		r = requests.get(url, stream=True)
@@ -75,6 +93,7 @@ def _download_file(url, path, showprogress=True):
 					print(f'\r[{progress_bar.ljust(20)}] {int(downloaded_size / total_size_in_bytes * 100)}%', end='')
 
 		print("\nDownload complete.")
+		return r.headers.get('ETag')
 	except Exception as e:
 		print("ERROR: [_download_file] %s" % (str(e)))
 		exit(1)
@@ -91,7 +110,7 @@ def _setup(download_dir, platform, showprogress=False):
         binary_path = os.path.join(download_dir, binary_name)
 
         # Download and extract
-        _download_file(url, archive_file_name, showprogress)
+        etag = _download_file(url, archive_file_name, showprogress)
 
         # Handle extraction
         if platform.startswith('Darwin'):
@@ -114,6 +133,10 @@ def _setup(download_dir, platform, showprogress=False):
         if os.path.exists(binary_path):
             print(f"StackQL executable successfully located at: {binary_path}")
             os.chmod(binary_path, 0o755)
+            # Record the release archive ETag so upgrade() can skip unchanged releases
+            if etag:
+                with open(_get_etag_path(download_dir), 'w') as f:
+                    f.write(etag)
         else:
             print(f"ERROR: Expected binary '{binary_path}' not found after extraction.")
             exit(1)
@@ -1,7 +1,6 @@
 from __future__ import print_function
 from IPython.core.magic import (Magics)
 from string import Template
-import pandas as pd
 
 class BaseStackqlMagic(Magics):
     """Base Jupyter magic extension enabling running StackQL queries.
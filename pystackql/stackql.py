@@ -4,13 +4,12 @@ from ._util import (
     _get_download_dir,
     _get_binary_name,
 	_is_binary_local,
+	_is_latest,
     _setup,
     _get_version,
     _format_auth
 )
-import sys, subprocess, json, os, asyncio, functools
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
-import pandas as pd
+import subprocess, json, os, asyncio
 import tempfile
 
 from io import StringIO
@@ -529,14 +528,23 @@ class StackQL:
 
 		This method initiates an upgrade of the StackQL binary. Post-upgrade,
 		it updates the `version` and `sha` attributes of the StackQL instance
-		to reflect the newly installed version.
+		to reflect the newly installed version and prints the new version.
+
+		If the installed binary came from the current latest release (the ETag
+		stored at install time still matches the release archive), nothing is
+		downloaded, `version` and `sha` are left unchanged and a message that
+		stackql is already the latest version is printed instead. If the release
+		check fails, for example on a network error, the binary is downloaded.
 
 		:param showprogress: Indicates if progress should be displayed during the upgrade. Defaults to True.
 		:type showprogress: bool, optional
 
-		:return: A message indicating the new version of StackQL post-upgrade.
-		:rtype: str
+		:return: None, the outcome is printed.
+		:rtype: None
 		"""
+		if os.path.exists(self.bin_path) and _is_latest(self.download_dir):
+			print("stackql is already the latest version %s" % (self.version))
+			return
 		_setup(self.download_dir, self.platform, showprogress)
 		self.version, self.sha = _get_version(self.bin_path)
 		print("stackql upgraded to version %s" % (self.version))
@@ -569,6 +577,9 @@ class StackQL:
 			>>> result = stackql.executeStmt(stackql_query)
 			>>> result
 		"""
+		# pandas is only loaded for pandas output
+		if self.output == 'pandas':
+			import pandas as pd
 		if self.server_mode:
 			result = self._run_server_query(query, is_statement=True)
 			if self.output == 'pandas':
@@ -642,6 +653,9 @@ class StackQL:
 			... '''
 			>>> result = stackql.execute(query)
 		"""
+		# pandas is only loaded for pandas output
+		if self.output == 'pandas':
+			import pandas as pd
 		if self.server_mode:
 			result = self._run_server_query(query)
 			if self.output == 'pandas':
@@ -751,6 +765,7 @@ class StackQL:
 				result = json.loads(query_results["data"]) 
 		# Convert the result to a DataFrame if necessary.
 		if self.output == 'pandas':
+			import pandas as pd
 			return pd.DataFrame(result)
 		else:
 			return result
@@ -793,15 +808,16 @@ class StackQL:
 		if self.output not in ['dict', 'pandas']:
 			raise ValueError("executeQueriesAsync supports only 'dict' or 'pandas' output modes.")
 		async def main():
-			with ThreadPoolExecutor() as executor:
-				# New connection is created for each query in server_mode, reused otherwise.
-				new_connection = self.server_mode
-				# Gather results from all the async calls.
-				loop = asyncio.get_event_loop()
-				futures = [loop.run_in_executor(executor, self._sync_query, query, new_connection) for query in queries]
-				results = await asyncio.gather(*futures)
+			# New connection is created for each query in server_mode, reused otherwise.
+			new_connection = self.server_mode
+			# Gather results from all the async calls, using the event loop's default
+			# executor so its worker threads are reused across calls on the same loop.
+			loop = asyncio.get_running_loop()
+			futures = [loop.run_in_executor(None, self._sync_query, query, new_connection) for query in queries]
+			results = await asyncio.gather(*futures)
 			# Concatenate DataFrames if output mode is 'pandas'.
 			if self.output == 'pandas':
+				import pandas as pd
 				return pd.concat(results, ignore_index=True)
 			else:
 				return [item for sublist in results for item in sublist]
@@ -1,33 +1,48 @@
-import sys, os, unittest, asyncio, re
-from unittest.mock import MagicMock, patch
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from pystackql import StackQL, magic, magics, StackqlMagic, StackqlServerMagic
+import os, unittest, tempfile, requests
+from unittest.mock import patch, Mock
+from pystackql import StackQL
+from pystackql._util import _is_latest, _get_etag_path
 from .test_params import *
 
+# used by test_06 in both its setup decorator and its body
+custom_download_dir = get_custom_download_dir(platform.system().lower())
+binary_name = 'stackql' if not is_windows else 'stackql.exe'
+
 def pystackql_test_setup(**kwargs):
     def decorator(func):
         def wrapper(self, *args):
-            try:
-                del self.stackql
-            except AttributeError:
-                pass
-            self.stackql = StackQL(**kwargs)
+            # instances are shared between tests with the same kwargs, tests must not mutate them
+            key = tuple(sorted(kwargs.items()))
+            if key not in PyStackQLTestsBase._instances:
+                PyStackQLTestsBase._instances[key] = StackQL(**kwargs)
+            self.stackql = PyStackQLTestsBase._instances[key]
             func(self, *args)
         return wrapper
     return decorator
 
-def async_test_decorator(func):
-    def wrapper(*args, **kwargs):
-        if asyncio.iscoroutinefunction(func):
-            return asyncio.run(func(*args, **kwargs))
-        else:
-            return func(*args, **kwargs)
-    return wrapper
-
 class PyStackQLTestsBase(unittest.TestCase):
-    pass
+    server_process = None
+    server_started = False
+    _instances = {}
+
+def start_server():
+    """Starts the stackql server for the first server mode test class, it is stopped in tearDownModule.
+
+    Checked once per class rather than letting every test fail without a server: a server
+    that is not ready skips the calling class on local runs and fails it in CI.
+    """
+    if not PyStackQLTestsBase.server_started:
+        PyStackQLTestsBase.server_process = start_stackql_server(PyStackQLTestsBase.stackql.bin_path)
+        PyStackQLTestsBase.server_started = True
+    if not server_is_ready():
+        message = f"stackql server not available on {server_address}:{server_port}"
+        if running_in_ci:
+            raise RuntimeError(message)
+        raise unittest.SkipTest(message)
 
 def setUpModule():
+    # created here rather than at import, test_06 downloads the binary into it
+    os.makedirs(custom_download_dir, exist_ok=True)
     print("downloading stackql binary...")
     PyStackQLTestsBase.stackql = StackQL()
 	# Check whether code is running in GitHub Actions
@@ -38,30 +53,29 @@ def setUpModule():
         print("Running tests outside of GitHub Actions, upgrading stackql binary...")
         PyStackQLTestsBase.stackql.upgrade()
 
-    print("downloading aws provider for tests...")
-    res = PyStackQLTestsBase.stackql.executeStmt(registry_pull_aws_query)
-    print("downloading google provider for tests...")
-    res = PyStackQLTestsBase.stackql.executeStmt(registry_pull_google_query)
-    print("starting stackql server...")
-    PyStackQLTestsBase.server_process = subprocess.Popen([PyStackQLTestsBase.stackql.bin_path, "srv", "--pgsrv.address", server_address, "--pgsrv.port", str(server_port)])
-    time.sleep(10)
+    print("downloading providers for tests...")
+    # okta is pulled on every run alongside the fixture providers, test_10 checks its result
+    results = ensure_providers(PyStackQLTestsBase.stackql, [registry_pull_aws_query, registry_pull_google_query], always=[registry_pull_okta_query])
+    PyStackQLTestsBase.okta_pull_result = results[-1]
 
 def tearDownModule():
-    print("stopping stackql server...")
+    flush_test_results()
     if PyStackQLTestsBase.server_process:
+        print("stopping stackql server...")
         PyStackQLTestsBase.server_process.terminate()
         PyStackQLTestsBase.server_process.wait()
 
 class PyStackQLNonServerModeTests(PyStackQLTestsBase):
+    # Tests without pystackql_test_setup use the default StackQL instance built
+    # once in setUpModule; only tests needing other constructor args build their own.
 
-    @pystackql_test_setup()
     def test_01_properties_class_method(self):
         properties = self.stackql.properties()
         # Check that properties is a dictionary
         self.assertTrue(isinstance(properties, dict), "properties should be a dictionary")
         # List of keys we expect to be in the properties
-        missing_keys = [key for key in expected_properties if key not in properties]
-        self.assertTrue(len(missing_keys) == 0, f"Missing keys in properties: {', '.join(missing_keys)}")
+        missing_keys = set(expected_properties).difference(properties)
+        self.assertFalse(missing_keys, f"Missing keys in properties: {', '.join(sorted(missing_keys))}")
         # Further type checks (as examples)
         self.assertIsInstance(properties["bin_path"], str, "bin_path should be of type str")
         self.assertIsInstance(properties["params"], list, "params should be of type list")
@@ -70,49 +84,46 @@ class PyStackQLNonServerModeTests(PyStackQLTestsBase):
         # If all the assertions pass, then the properties are considered valid.
         print_test_result(f"""Test 01 properties method\nPROPERTIES: {properties}""", True)
 
-    @pystackql_test_setup()
     def test_02_version_attribute(self):
         version = self.stackql.version
         self.assertIsNotNone(version)
-        is_valid_semver = bool(re.match(expected_version_pattern, version))
+        is_valid_semver = bool(expected_version_re.match(version))
         self.assertTrue(is_valid_semver)
         print_test_result(f"""Test 02 version attribute\nVERSION: {version}""", is_valid_semver)
 
-    @pystackql_test_setup()
     def test_03_package_version_attribute(self):
         package_version = self.stackql.package_version
         self.assertIsNotNone(package_version)
-        is_valid_semver = bool(re.match(expected_package_version_pattern, package_version))
+        is_valid_semver = bool(expected_package_version_re.match(package_version))
         self.assertTrue(is_valid_semver)
         print_test_result(f"""Test 03 package_version attribute\nPACKAGE VERSION: {package_version}""", is_valid_semver)
 
-    @pystackql_test_setup()
     def test_04_platform_attribute(self):
         platform_string = self.stackql.platform
         self.assertIsNotNone(platform_string)
-        is_valid_platform = bool(re.match(expected_platform_pattern, platform_string))
+        is_valid_platform = bool(expected_platform_re.match(platform_string))
         self.assertTrue(is_valid_platform)
         print_test_result(f"""Test 04 platform attribute\nPLATFORM: {platform_string}""", is_valid_platform)
 
-    @pystackql_test_setup()
     def test_05_bin_path_attribute(self):
-        self.assertTrue(os.path.exists(self.stackql.bin_path))
-        print_test_result(f"""Test 05 bin_path attribute with default download path\nBINARY PATH: {self.stackql.bin_path}""", os.path.exists(self.stackql.bin_path))
+        bin_path_exists = os.path.exists(self.stackql.bin_path)
+        self.assertTrue(bin_path_exists)
+        print_test_result(f"""Test 05 bin_path attribute with default download path\nBINARY PATH: {self.stackql.bin_path}""", bin_path_exists)
 
-    @pystackql_test_setup(download_dir=get_custom_download_dir(platform.system().lower()))
+    @pystackql_test_setup(download_dir=custom_download_dir)
     def test_06_set_custom_download_dir(self):
         # Checking that version is not None
         version = self.stackql.version
         self.assertIsNotNone(version)
         # Checking that download_dir is correctly set
-        expected_download_dir = get_custom_download_dir(platform.system().lower())
+        expected_download_dir = custom_download_dir
         self.assertEqual(self.stackql.download_dir, expected_download_dir, "Download directory is not set correctly.")
         # Checking that the binary exists at the expected location
-        binary_name = 'stackql' if platform.system().lower() != 'windows' else 'stackql.exe'
         expected_binary_path = os.path.join(expected_download_dir, binary_name)
-        self.assertTrue(os.path.exists(expected_binary_path), f"No binary found at {expected_binary_path}")
+        binary_exists = os.path.exists(expected_binary_path)
+        self.assertTrue(binary_exists, f"No binary found at {expected_binary_path}")
         # Final test result print
-        print_test_result(f"""Test 06 setting a custom download_dir\nCUSTOM_DOWNLOAD_DIR: {expected_download_dir}""", version is not None and os.path.exists(expected_binary_path))
+        print_test_result(f"""Test 06 setting a custom download_dir\nCUSTOM_DOWNLOAD_DIR: {expected_download_dir}""", version is not None and binary_exists)
 
     @pystackql_test_setup(output="csv")
     def test_07_csv_output_with_defaults(self):
@@ -151,53 +162,46 @@ class PyStackQLNonServerModeTests(PyStackQLTestsBase):
         self.assertNotIn("--hideheaders", self.stackql.params)
         print_test_result(f"""Test 09 csv output with headers (comma delimited with headers)\nPARAMS: {self.stackql.params}""", True)
 
-    @pystackql_test_setup()
     def test_10_executeStmt(self):
-        okta_result_dict = self.stackql.executeStmt(registry_pull_okta_query)
+        # pulled by the default instance in setUpModule
+        okta_result_dict = self.okta_pull_result
         okta_result = okta_result_dict["message"]
-        expected_pattern = registry_pull_resp_pattern("okta")
-        self.assertTrue(re.search(expected_pattern, okta_result), f"Expected pattern not found in result: {okta_result}")
-        print_test_result(f"""Test 10 executeStmt method\nRESULTS:\n{okta_result_dict}""", True)
+        self.assertTrue(registry_pull_resp_re["okta"].search(okta_result), f"Expected pattern not found in result: {okta_result}")
+        print_test_result("Test 10 executeStmt method", True, result=okta_result_dict)
 
     @pystackql_test_setup(output="csv")
     def test_11_executeStmt_with_csv_output(self):
         github_result = self.stackql.executeStmt(registry_pull_github_query)
-        expected_pattern = registry_pull_resp_pattern("github")
-        self.assertTrue(re.search(expected_pattern, github_result), f"Expected pattern not found in result: {github_result}")
-        print_test_result(f"""Test 11 executeStmt method with csv output\nRESULTS:\n{github_result}""", True)
+        self.assertTrue(registry_pull_resp_re["github"].search(github_result), f"Expected pattern not found in result: {github_result}")
+        print_test_result("Test 11 executeStmt method with csv output", True, result=github_result)
 
     @pystackql_test_setup(output="pandas")
     def test_12_executeStmt_with_pandas_output(self):
         homebrew_result_df = self.stackql.executeStmt(registry_pull_homebrew_query)
         homebrew_result = homebrew_result_df['message'].iloc[0]
-        expected_pattern = registry_pull_resp_pattern("homebrew")
-        self.assertTrue(re.search(expected_pattern, homebrew_result), f"Expected pattern not found in result: {homebrew_result}")
-        print_test_result(f"""Test 12 executeStmt method with pandas output\nRESULTS:\n{homebrew_result_df}""", True)
+        self.assertTrue(registry_pull_resp_re["homebrew"].search(homebrew_result), f"Expected pattern not found in result: {homebrew_result}")
+        print_test_result("Test 12 executeStmt method with pandas output", True, result=homebrew_result_df)
 
-    @pystackql_test_setup()
     def test_13_execute_with_defaults(self):
         result = self.stackql.execute(google_show_services_query)
-        is_valid_data_resp = (
-            isinstance(result, list) 
-            and all(isinstance(item, dict) and 'error' not in item for item in result)
-        )
-        # Truncate the result message if it's too long
-        truncated_result = (
-            str(result)[:500] + '...' if len(str(result)) > 500 else str(result)
-        )
-        self.assertTrue(is_valid_data_resp, f"Result is not valid: {truncated_result}")
-        print_test_result(f"Test 13 execute with defaults\nRESULT: {truncated_result}", is_valid_data_resp)
+        is_valid_data_resp = is_dict_rows(result)
+        if not is_valid_data_resp:
+            # the result is only formatted, and truncated if it's too long, when the test fails
+            result_str = str(result)
+            self.fail(f"Result is not valid: {result_str[:500] + '...' if len(result_str) > 500 else result_str}")
+        print_test_result("Test 13 execute with defaults", is_valid_data_resp, result=result)
 
 
     def test_14_execute_with_defaults_null_response(self):
         result = self.stackql.execute("SELECT 1 WHERE 1=0")
         is_valid_empty_resp = isinstance(result, list) and len(result) == 0
         self.assertTrue(is_valid_empty_resp, f"Result is not a empty list: {result}")
-        print_test_result(f"Test 14 execute with defaults (empty response)\nRESULT: {result}", is_valid_empty_resp)        
+        print_test_result("Test 14 execute with defaults (empty response)", is_valid_empty_resp, result=result)        
 
     @pystackql_test_setup(output='pandas')
     @patch('pystackql.StackQL.execute')
     def test_15_execute_with_pandas_output(self, mock_execute):
+        import pandas as pd
         # mocking the response for pandas DataFrame
         mock_execute.return_value = pd.DataFrame({
             'status': ['RUNNING', 'TERMINATED'], 
@@ -227,7 +231,6 @@ class PyStackQLNonServerModeTests(PyStackQLTestsBase):
         self.assertTrue(is_valid_csv, f"Result is not a valid CSV: {result}")
         print_test_result(f"Test 16 execute with csv output\nRESULT_COUNT: {len(result.splitlines())}", is_valid_csv)
 
-    @pystackql_test_setup()
     def test_17_execute_default_auth_dict_output(self):
         result = self.stackql.execute(github_query)
         # Expected result based on default auth
@@ -236,15 +239,15 @@ class PyStackQLNonServerModeTests(PyStackQLTestsBase):
         ]
         self.assertTrue(isinstance(result, list), "Result should be a list")
         self.assertEqual(result, expected_result, f"Expected result: {expected_result}, got: {result}")
-        print_test_result(f"Test 17 execute with default auth and dict output\nRESULT: {result}", result == expected_result)
+        print_test_result("Test 17 execute with default auth and dict output", result == expected_result, result=result)
 
 
-    @pystackql_test_setup()
+    @unittest.skipUnless(custom_github_username and custom_github_password, "CUSTOM_STACKQL_GITHUB_USERNAME and CUSTOM_STACKQL_GITHUB_PASSWORD are required")
     def test_18_execute_custom_auth_env_vars(self):
         # Set up custom environment variables for authentication
         env_vars = {
-            'command_specific_username': os.getenv('CUSTOM_STACKQL_GITHUB_USERNAME'),
-            'command_specific_password': os.getenv('CUSTOM_STACKQL_GITHUB_PASSWORD')
+            'command_specific_username': custom_github_username,
+            'command_specific_password': custom_github_password
         }
         # Define custom authentication configuration
         custom_auth = {
@@ -261,9 +264,8 @@ class PyStackQLNonServerModeTests(PyStackQLTestsBase):
         ]
         self.assertTrue(isinstance(result, list), "Result should be a list")
         self.assertEqual(result, expected_result, f"Expected result: {expected_result}, got: {result}")
-        print_test_result(f"Test 18 execute with custom auth and command-specific environment variables\nRESULT: {result}", result == expected_result)
+        print_test_result("Test 18 execute with custom auth and command-specific environment variables", result == expected_result, result=result)
 
-    @pystackql_test_setup()
     def test_19_json_extract_function(self):
         query = """
         SELECT
@@ -275,62 +277,155 @@ class PyStackQLNonServerModeTests(PyStackQLTestsBase):
         ]
         result = self.stackql.execute(query)
         self.assertEqual(result, expected_result, f"Expected result: {expected_result}, got: {result}")
-        print_test_result(f"Test 19 complex object handling\nRESULT: {result}", result == expected_result)
+        print_test_result("Test 19 complex object handling", result == expected_result, result=result)
+
 
+class PyStackQLUpgradeTests(PyStackQLTestsBase):
+    # the release check is mocked, no request is made to the download server
 
-@unittest.skipIf(platform.system() == "Windows", "Skipping async tests on Windows")
+    def setUp(self):
+        self.download_dir = tempfile.mkdtemp()
+        self.etag = '"release-etag"'
+        with open(_get_etag_path(self.download_dir), 'w') as f:
+            f.write(self.etag)
+
+    def tearDown(self):
+        os.remove(_get_etag_path(self.download_dir))
+        os.rmdir(self.download_dir)
+
+    def head_response(self, status_code, etag=None):
+        response = Mock(status_code=status_code, ok=status_code < 400, headers={})
+        if etag:
+            response.headers['ETag'] = etag
+        return response
+
+    @patch('pystackql._util.requests.head')
+    def test_01_is_latest_not_modified(self, mock_head):
+        mock_head.return_value = self.head_response(304)
+        is_latest = _is_latest(self.download_dir)
+        self.assertTrue(is_latest, "A 304 response should mean the binary is the latest")
+        self.assertEqual(mock_head.call_args.kwargs['headers'], {'If-None-Match': self.etag})
+        print_test_result("Test 01 upgrade check with not modified response", is_latest)
+
+    @patch('pystackql._util.requests.head')
+    def test_02_is_latest_matching_etag(self, mock_head):
+        mock_head.return_value = self.head_response(200, self.etag)
+        is_latest = _is_latest(self.download_dir)
+        self.assertTrue(is_latest, "A matching ETag should mean the binary is the latest")
+        print_test_result("Test 02 upgrade check with matching ETag", is_latest)
+
+    @patch('pystackql._util.requests.head')
+    def test_03_is_latest_changed_etag(self, mock_head):
+        mock_head.return_value = self.head_response(200, '"new-release-etag"')
+        is_latest = _is_latest(self.download_dir)
+        self.assertFalse(is_latest, "A changed ETag should mean a new release is available")
+        print_test_result("Test 03 upgrade check with changed ETag", not is_latest)
+
+    @patch('pystackql._util.requests.head')
+    def test_04_is_latest_network_error(self, mock_head):
+        mock_head.side_effect = requests.exceptions.ConnectionError("network unreachable")
+        is_latest = _is_latest(self.download_dir)
+        self.assertFalse(is_latest, "A failed release check should fall through to downloading")
+        print_test_result("Test 04 upgrade check with network error", not is_latest)
+
+    @patch('pystackql.stackql._get_version')
+    @patch('pystackql.stackql._setup')
+    @patch('pystackql.stackql._is_latest')
+    def test_05_upgrade_downloads_only_when_not_latest(self, mock_is_latest, mock_setup, mock_get_version):
+        # keep the shared instance's version unchanged when the download path runs
+        mock_get_version.return_value = (self.stackql.version, self.stackql.sha)
+        mock_is_latest.return_value = True
+        self.stackql.upgrade()
+        mock_setup.assert_not_called()
+        mock_is_latest.return_value = False
+        self.stackql.upgrade()
+        mock_setup.assert_called_once_with(self.stackql.download_dir, self.stackql.platform, True)
+        print_test_result("Test 05 upgrade skips the download only when already latest", True)
+
+@unittest.skipIf(is_windows, "Skipping async tests on Windows")
 class PyStackQLAsyncTests(PyStackQLTestsBase):
 
     @async_test_decorator
     async def test_01_async_executeQueriesAsync(self):
-        stackql = StackQL()
-        results = await stackql.executeQueriesAsync(async_queries)
-        is_valid_results = all(isinstance(res, dict) for res in results)
+        results = await self.stackql.executeQueriesAsync(async_queries)
+        # each query aggregates to a single row, results are checked without relying on their order
+        is_valid_results = is_dict_rows(results, len(async_queries))
+        self.assertTrue(is_valid_results, f"Expected one row per query without errors, got: {results}")
         print_test_result(f"Test 01 executeQueriesAsync with default (dict) output\nRESULT_COUNT: {len(results)}", is_valid_results, is_async=True)
 
+    @pystackql_test_setup(output='pandas')
     @async_test_decorator
     async def test_02_async_executeQueriesAsync_with_pandas_output(self):
-        stackql = StackQL(output='pandas')
-        result = await stackql.executeQueriesAsync(async_queries)
+        import pandas as pd
+        result = await self.stackql.executeQueriesAsync(async_queries)
         is_valid_dataframe = isinstance(result, pd.DataFrame) and not result.empty
         print_test_result(f"Test 02 executeQueriesAsync with pandas output\nRESULT_COUNT: {len(result)}", is_valid_dataframe, is_async=True)
 
+    @pystackql_test_setup(output='csv')
     @async_test_decorator
     async def test_03_async_executeQueriesAsync_with_csv_output(self):
-        stackql = StackQL(output='csv')
         exception_caught = False
         try:
             # This should raise a ValueError since 'csv' output mode is not supported
-            await stackql.executeQueriesAsync(async_queries)
+            await self.stackql.executeQueriesAsync(async_queries)
         except ValueError as ve:
-            exception_caught = str(ve) == "executeQueriesAsync supports only 'dict' or 'pandas' output modes."
+            exception_caught = str(ve) == async_csv_output_error
         except Exception as e:
             pass
         print_test_result(f"Test 03 executeQueriesAsync with unsupported csv output", exception_caught, is_async=True)
 
-class PyStackQLServerModeNonAsyncTests(PyStackQLTestsBase):
+class PyStackQLServerModeTestsBase(PyStackQLTestsBase):
+    # server mode instances hold an open connection so they are built per class
+
+    @classmethod
+    def setUpClass(cls):
+        # one connection per output mode, shared by every test in the class
+        cls.server_stackql = StackQL(server_mode=True)
+        cls.server_stackql_pandas = StackQL(server_mode=True, output='pandas')
+
+    @classmethod
+    def tearDownClass(cls):
+        for stackql in (cls.server_stackql, cls.server_stackql_pandas):
+            if stackql._conn:
+                stackql._conn.close()
+
+@unittest.skipUnless(server_mode_available, "psycopg is required for server mode tests")
+class PyStackQLServerModeNonAsyncTests(PyStackQLServerModeTestsBase):
+
+    @classmethod
+    def setUpClass(cls):
+        start_server()
+        super().setUpClass()
 
-    @pystackql_test_setup(server_mode=True)
     def test_01_server_mode_connectivity(self):
-        self.assertTrue(self.stackql.server_mode, "StackQL should be in server mode")
-        self.assertIsNotNone(self.stackql._conn, "Connection object should not be None")
+        self.assertTrue(self.server_stackql.server_mode, "StackQL should be in server mode")
+        self.assertIsNotNone(self.server_stackql._conn, "Connection object should not be None")
         print_test_result("Test 01 server mode connectivity", True, True)
 
-    @pystackql_test_setup(server_mode=True)
     def test_02_server_mode_executeStmt(self):
-        result = self.stackql.executeStmt(registry_pull_google_query)
+        result = self.server_stackql.executeStmt(registry_pull_google_query)
         # Checking if the result is a list containing a single dictionary with a key 'message' and value 'OK'
-        is_valid_response = isinstance(result, list) and len(result) == 1 and result[0].get('message') == 'OK'
-        print_test_result(f"Test 02 executeStmt in server mode\n{result}", is_valid_response, True)
+        is_valid_response = is_single_row(result, 'message', 'OK')
+        print_test_result("Test 02 executeStmt in server mode", is_valid_response, True, result=result)
 
-    @pystackql_test_setup(server_mode=True, output='pandas')
     def test_03_server_mode_executeStmt_with_pandas_output(self):
-        result_df = self.stackql.executeStmt(registry_pull_google_query)
-        # Verifying if the result is a dataframe with a column 'message' containing the value 'OK' in its first row
-        is_valid_response = isinstance(result_df, pd.DataFrame) and 'message' in result_df.columns and result_df['message'].iloc[0] == 'OK'
-        print_test_result(f"Test 03 executeStmt in server mode with pandas output\n{result_df}", is_valid_response, True)
+        import pandas as pd
+        from pandas.testing import assert_frame_equal
+        result_df = self.server_stackql_pandas.executeStmt(registry_pull_google_query)
+        # Verifying the result is a dataframe with a single 'message' row containing 'OK'
+        assert_frame_equal(result_df, pd.DataFrame([{'message': 'OK'}]))
+        print_test_result("Test 03 executeStmt in server mode with pandas output", True, True, result=result_df)
+
+@unittest.skipUnless(server_mode_available, "psycopg is required for server mode tests")
+class PyStackQLServerModeMockedTests(PyStackQLServerModeTestsBase):
+    # server queries are mocked, these tests do not start the stackql server
+
+    @classmethod
+    def setUpClass(cls):
+        # no connection is opened either, every server query in the class is mocked
+        with patch('pystackql.stackql.StackQL._connect_to_server', return_value=None):
+            super().setUpClass()
 
-    @pystackql_test_setup(server_mode=True)
     @patch('pystackql.stackql.StackQL._run_server_query')
     def test_04_server_mode_execute_default_output(self, mock_run_server_query):
         # Mocking the response as a list of dictionaries
@@ -340,22 +435,21 @@ class PyStackQLServerModeNonAsyncTests(PyStackQLTestsBase):
         ]
         mock_run_server_query.return_value = mock_result
 
-        result = self.stackql.execute(google_query)
-        is_valid_dict_output = isinstance(result, list) and all(isinstance(row, dict) for row in result)
+        result = self.server_stackql.execute(google_query)
+        is_valid_dict_output = is_dict_rows(result, len(mock_result))
         print_test_result(f"""Test 04 execute in server_mode with default output\nRESULT_COUNT: {len(result)}""", is_valid_dict_output, True)
         # Check `_run_server_query` method
         mock_run_server_query.assert_called_once_with(google_query)
 
-    @pystackql_test_setup(server_mode=True, output='pandas')
     @patch('pystackql.stackql.StackQL._run_server_query')
     def test_05_server_mode_execute_pandas_output(self, mock_run_server_query):
-        # Mocking the response for pandas DataFrame
-        mock_df = pd.DataFrame({
-            'status': ['RUNNING', 'TERMINATED'],
-            'num_instances': [2, 1]
-        })
-        mock_run_server_query.return_value = mock_df.to_dict(orient='records')
-        result = self.stackql.execute(google_query)
+        import pandas as pd
+        # Mocking the server response as a list of dictionaries, converted to a DataFrame by execute
+        mock_run_server_query.return_value = [
+            {'status': 'RUNNING', 'num_instances': 2},
+            {'status': 'TERMINATED', 'num_instances': 1}
+        ]
+        result = self.server_stackql_pandas.execute(google_query)
         is_valid_dataframe = isinstance(result, pd.DataFrame)
         self.assertTrue(is_valid_dataframe, f"Result is not a valid DataFrame: {result}")
         # Check datatypes of the columns
@@ -384,51 +478,72 @@ class MockInteractiveShell:
         return MockInteractiveShell()
 
 class BaseStackQLMagicTests:
-    MAGIC_CLASS = None  # To be overridden by child classes
+    MAGIC_CLASS = None  # Name of the magic class, to be overridden by child classes
     server_mode = None  # To be overridden by child classes
-    def setUp(self):
-        """Set up for the magic tests."""
-        assert self.MAGIC_CLASS, "MAGIC_CLASS should be set by child classes"
-        self.shell = MockInteractiveShell.instance()
-        if self.server_mode:
-            magics.load_ipython_extension(self.shell)
+
+    @classmethod
+    def setUpClass(cls):
+        """Load the extension and build the magic once for all tests in the class.
+
+        Tests must not leave state behind on the shared magic or shell; any test
+        adding to `user_ns` other than `stackql_df` should remove it in tearDown.
+        `stackql_df` itself is cleared in setUp.
+        """
+        assert cls.MAGIC_CLASS, "MAGIC_CLASS should be set by child classes"
+        cls.shell = MockInteractiveShell.instance()
+        # the magic modules import IPython, so they are only loaded when the magic tests run
+        if cls.server_mode:
+            from pystackql import magics as magic_module
         else:
-            magic.load_ipython_extension(self.shell)
-        self.stackql_magic = self.MAGIC_CLASS(shell=self.shell)
-        self.query = "SELECT 1 as fred"
-        self.expected_result = pd.DataFrame({"fred": [1]})
-        self.statement = "REGISTRY PULL github"
+            from pystackql import magic as magic_module
+        magic_module.load_ipython_extension(cls.shell)
+        cls.stackql_magic = getattr(magic_module, cls.MAGIC_CLASS)(shell=cls.shell)
+        # fixtures are only read by the tests, so they are built once per class
+        import pandas as pd
+        cls.query = "SELECT 1 as fred"
+        cls.expected_result = pd.DataFrame({"fred": [1]})
+        cls.statement = "REGISTRY PULL github"
+
+    def setUp(self):
+        super().setUp()
+        # `user_ns` is shared by every mock shell, so a frame stored by an earlier test
+        # must not satisfy the checks on `stackql_df`
+        self.shell.user_ns.pop('stackql_df', None)
 
-    def print_test_result(self, test_name, *checks):
+    def assert_test_result(self, test_name, *checks, result=None):
         all_passed = all(checks)
-        print_test_result(f"{test_name}", all_passed, self.server_mode, True)
+        print_test_result(f"{test_name}", all_passed, self.server_mode, True, result=result)
+        self.assertTrue(all_passed, f"{test_name} failed, checks: {checks}")
 
     def run_magic_test(self, line, cell, expect_none=False):
-        # Mock the run_query method to return a known DataFrame.
-        self.stackql_magic.run_query = MagicMock(return_value=self.expected_result)
-        # Execute the magic with our query.
-        result = self.stackql_magic.stackql(line=line, cell=cell)
+        # Mock the run_query method to return a known DataFrame, restored after the call
+        # as the magic instance is shared with the statement tests.
+        with patch.object(self.stackql_magic, 'run_query', new=lambda *args, **kwargs: self.expected_result):
+            # Execute the magic with our query.
+            result = self.stackql_magic.stackql(line=line, cell=cell)
         # Validate the outcome.
         checks = []
         if expect_none:
             checks.append(result is None)
         else:
-            checks.append(result.equals(self.expected_result))
-        checks.append('stackql_df' in self.shell.user_ns)
-        checks.append(self.shell.user_ns['stackql_df'].equals(self.expected_result))
+            checks.append(list(result.columns) == ["fred"] and result.iloc[0, 0] == 1)
+        stored = self.shell.user_ns.get('stackql_df')
+        checks.append(stored is not None)
+        # the stubbed run_query returns the fixture itself, so the magic must store that object
+        checks.append(stored is self.expected_result)
         return checks
     
     def test_01_line_magic_query(self):
         checks = self.run_magic_test(line=self.query, cell=None)
-        self.print_test_result("Test 01 Line magic query test", *checks)
+        self.assert_test_result("Test 01 Line magic query test", *checks)
 
     def test_02_cell_magic_query(self):
         checks = self.run_magic_test(line="", cell=self.query)
-        self.print_test_result("Test 02 Cell magic query test", *checks)
+        self.assert_test_result("Test 02 Cell magic query test", *checks)
 
     def test_03_cell_magic_query_no_output(self):
         checks = self.run_magic_test(line="--no-display", cell=self.query, expect_none=True)
-        self.print_test_result("Test 03 Cell magic query test (with --no-display)", *checks)
+        self.assert_test_result("Test 03 Cell magic query test (with --no-display)", *checks)
 
     def run_magic_statement_test(self, line, cell, expect_none=False):
         # Execute the magic with our statement.
@@ -442,40 +557,47 @@ class BaseStackQLMagicTests:
             if self.server_mode:
                 checks.append("OK" in result["message"].iloc[0])
             else:
-                pattern = registry_pull_resp_pattern('github')
                 message = result["message"].iloc[0] if "message" in result.columns else ""
-                checks.append(bool(re.search(pattern, message)))        
+                checks.append(bool(registry_pull_resp_re['github'].search(message)))
         # Check dataframe exists and is populated as expected
-        checks.append('stackql_df' in self.shell.user_ns)
+        stored = self.shell.user_ns.get('stackql_df')
+        checks.append(stored is not None)
         if self.server_mode:
-            checks.append("OK" in self.shell.user_ns['stackql_df']["message"].iloc[0])
+            checks.append("OK" in stored["message"].iloc[0])
         else:
-            pattern = registry_pull_resp_pattern('github')
-            message = self.shell.user_ns['stackql_df']["message"].iloc[0] if 'stackql_df' in self.shell.user_ns else ""
-            checks.append(bool(re.search(pattern, message)))
+            message = stored["message"].iloc[0] if stored is not None else ""
+            checks.append(bool(registry_pull_resp_re['github'].search(message)))
         return checks, result
 
     def test_04_line_magic_statement(self):
         checks, result = self.run_magic_statement_test(line=self.statement, cell=None)
-        self.print_test_result(f"Test 04 Line magic statement test\n{result}", *checks)
+        self.assert_test_result("Test 04 Line magic statement test", *checks, result=result)
 
     def test_05_cell_magic_statement(self):
         checks, result = self.run_magic_statement_test(line="", cell=self.statement)
-        self.print_test_result(f"Test 05 Cell magic statement test\n{result}", *checks)
+        self.assert_test_result("Test 05 Cell magic statement test", *checks, result=result)
 
     def test_06_cell_magic_statement_no_output(self):
         checks, result = self.run_magic_statement_test(line="--no-display", cell=self.statement, expect_none=True)
-        self.print_test_result(f"Test 06 Cell magic statement test (with --no-display)\n{result}", *checks)
+        self.assert_test_result("Test 06 Cell magic statement test (with --no-display)", *checks, result=result)
 
+@unittest.skipUnless(ipython_available, "IPython is required for magic tests")
 class StackQLMagicTests(BaseStackQLMagicTests, unittest.TestCase):
 
-    MAGIC_CLASS = StackqlMagic
+    MAGIC_CLASS = "StackqlMagic"
     server_mode = False
 
+@unittest.skipUnless(ipython_available, "IPython is required for magic tests")
+@unittest.skipUnless(server_mode_available, "psycopg is required for server mode tests")
 class StackQLServerMagicTests(BaseStackQLMagicTests, unittest.TestCase):
-    MAGIC_CLASS = StackqlServerMagic
+    MAGIC_CLASS = "StackqlServerMagic"
     server_mode = True
 
+    @classmethod
+    def setUpClass(cls):
+        start_server()
+        super().setUpClass()
+
 def main():
     unittest.main(verbosity=0)
 
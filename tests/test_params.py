@@ -1,11 +1,28 @@
-import json, sys, platform, re, time, unittest, subprocess
-import pandas as pd
-from termcolor import colored
-import unittest.mock as mock
+import os, sys, platform, time, subprocess, socket, re, importlib.util, logging, logging.handlers, asyncio, atexit
+
+# test results are reported through a logger so they can be silenced or redirected,
+# they are buffered and written out in one go by flush_test_results (or at exit)
+logger = logging.getLogger("pystackql.tests")
+# full query results are only rendered when PYSTACKQL_TEST_VERBOSE is set
+logger.setLevel(logging.DEBUG if os.environ.get('PYSTACKQL_TEST_VERBOSE') else logging.INFO)
+_result_buffer = logging.handlers.MemoryHandler(capacity=10000, flushLevel=logging.CRITICAL + 1, target=logging.StreamHandler(sys.stdout))
+logger.addHandler(_result_buffer)
+logger.propagate = False
+
+def flush_test_results():
+    _result_buffer.flush()
+    sys.stdout.flush()
+
+# only colour the status headers when writing to a terminal
+use_color = sys.stdout.isatty()
 
 server_port = 5466
 server_address = "127.0.0.1"
 
+# server mode needs psycopg, checked without importing it
+server_mode_available = importlib.util.find_spec("psycopg") is not None
+ipython_available = importlib.util.find_spec("IPython") is not None
+
 expected_properties = [
     "bin_path", "download_dir", "package_version", "params", 
     "output", "platform", "server_mode", "sha", "version"
@@ -15,15 +32,122 @@ expected_version_pattern = r'^v?(\d+\.\d+\.\d+)$'
 expected_package_version_pattern = r'^(\d+\.\d+\.\d+)$'
 
 expected_platform_pattern = r'^(Windows|Linux|Darwin) (\w+) \(([^)]+)\), Python (\d+\.\d+\.\d+)$'
-# custom_windows_download_dir = 'C:\\temp'
-# custom_mac_linux_download_dir = '/tmp'
+
+expected_version_re = re.compile(expected_version_pattern)
+expected_package_version_re = re.compile(expected_package_version_pattern)
+expected_platform_re = re.compile(expected_platform_pattern)
+# async tests share one event loop instead of creating one per test with asyncio.run,
+# uvloop's when it is installed, closed when the test process exits
+try:
+    import uvloop
+    _test_loop = uvloop.new_event_loop()
+except ImportError:
+    _test_loop = asyncio.new_event_loop()
+atexit.register(_test_loop.close)
+
+def async_test_decorator(func):
+    def wrapper(*args, **kwargs):
+        if asyncio.iscoroutinefunction(func):
+            return _test_loop.run_until_complete(func(*args, **kwargs))
+        else:
+            return func(*args, **kwargs)
+    return wrapper
+
+def pull_providers(stackql, queries):
+    """Runs the REGISTRY PULL statements one after another.
+
+    Every pull writes into the same `.stackql` app root, so they are not run concurrently.
+    """
+    return [stackql.executeStmt(query) for query in queries]
+
+# providers pulled as test fixtures are reused for a day, the sentinel sits with the
+# registry in the default app root so removing `.stackql` forces a fresh pull
+providers_sentinel = os.path.join(os.getcwd(), '.stackql', '.test_providers_ready')
+providers_ttl = 24 * 60 * 60
+
+def providers_ready():
+    return os.path.exists(providers_sentinel) and time.time() - os.path.getmtime(providers_sentinel) < providers_ttl
+
+def pull_succeeded(query, result):
+    """True if `result` reports the provider pulled by `query` as installed.
+
+    A failed pull in dict mode still returns a message row (stackql's stderr), so the message
+    is matched against the expected install line rather than checked for an error key.
+    """
+    provider = query.split()[-1]
+    return isinstance(result, dict) and bool(registry_pull_resp_re[provider].search(result.get('message', '')))
+
+def ensure_providers(stackql, queries, always=()):
+    """Pulls the providers used as test fixtures unless they were pulled within `providers_ttl`.
+
+    Pulls in `always` run on every call, after the fixture pulls; the results of
+    all pulls made are returned with the `always` results last.
+    """
+    fixture_queries = [] if providers_ready() else list(queries)
+    if not fixture_queries:
+        print("test providers pulled recently, skipping fixture registry pulls...")
+    results = pull_providers(stackql, fixture_queries + list(always))
+    if fixture_queries and all(pull_succeeded(query, result) for query, result in zip(fixture_queries, results)):
+        os.makedirs(os.path.dirname(providers_sentinel), exist_ok=True)
+        with open(providers_sentinel, 'w'):
+            pass
+    return results
+
+def server_is_listening(timeout=0.1):
+    try:
+        with socket.create_connection((server_address, server_port), timeout):
+            return True
+    except OSError:
+        return False
+
+# CI sets these to 'true', a value such as CI=false means a local run
+running_in_ci = any(os.environ.get(var, '').lower() == 'true' for var in ('GITHUB_ACTIONS', 'CI'))
+
+def server_is_ready():
+    """Checks the server completes a pg wire handshake, falls back to a TCP connect if psycopg is not installed."""
+    try:
+        import psycopg
+    except ImportError:
+        return server_is_listening()
+    try:
+        with psycopg.connect(dbname='stackql', user='stackql', host=server_address, port=server_port, connect_timeout=2):
+            return True
+    except psycopg.OperationalError:
+        return False
+
+def wait_for_server(timeout):
+    deadline = time.monotonic() + timeout
+    while not server_is_ready():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+def start_stackql_server(bin_path, timeout=30):
+    """Starts a stackql server, returns None if a server is already listening and was reused."""
+    if server_is_listening():
+        print("reusing running stackql server...")
+        return None
+    print("starting stackql server...")
+    # server logs are discarded so they never interleave with (or block on) the test output,
+    # and a new session keeps signals sent to the server away from the test runner
+    server_process = subprocess.Popen(
+        [bin_path, "srv", "--pgsrv.address", server_address, "--pgsrv.port", str(server_port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, close_fds=True, start_new_session=True
+    )
+    if not wait_for_server(timeout):
+        print(f"stackql server not listening on {server_address}:{server_port} after {timeout}s")
+    return server_process
+
+# persistent location for binaries downloaded by the tests so reruns skip the download
+test_cache_dir = os.environ.get('PYSTACKQL_TEST_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'pystackql-tests'))
+
+# the platform does not change during a run
+is_windows = platform.system() == "Windows"
+
 def get_custom_download_dir(platform_name):
-    custom_download_dirs = {
-        'windows': 'C:\\temp',
-        'darwin': '/tmp',
-        'linux': '/tmp'
-    }
-    return custom_download_dirs.get(platform_name, '/tmp')
+    # only resolves the path, the directory is created by the test setup
+    return os.path.join(test_cache_dir, platform_name)
 
 registry_pull_google_query = "REGISTRY PULL google"
 registry_pull_aws_query = "REGISTRY PULL aws"
@@ -34,6 +158,13 @@ registry_pull_homebrew_query = "REGISTRY PULL homebrew"
 def registry_pull_resp_pattern(provider):
     return r"%s provider, version 'v\d+\.\d+\.\d+' successfully installed\s*" % provider
 
+# compiled once for every provider the tests pull
+registry_pull_resp_re = {provider: re.compile(registry_pull_resp_pattern(provider)) for provider in ("aws", "google", "okta", "github", "homebrew")}
+
+# credentials for the custom auth test, read once at import
+custom_github_username = os.environ.get('CUSTOM_STACKQL_GITHUB_USERNAME')
+custom_github_password = os.environ.get('CUSTOM_STACKQL_GITHUB_PASSWORD')
+
 test_gcp_project_id = "test-gcp-project"
 test_gcp_zone = "australia-southeast2-a"
 
@@ -68,18 +199,44 @@ async_queries = [
     for region in test_aws_regions
 ]
 
-def print_test_result(test_name, condition=True, server_mode=False, is_ipython=False, is_async=False):
-    status_header = colored("[PASSED] ", 'green') if condition else colored("[FAILED] ", 'red')
-    headers = [status_header]
+# expected error when executeQueriesAsync is asked for csv output
+async_csv_output_error = "executeQueriesAsync supports only 'dict' or 'pandas' output modes."
+
+def is_dict_rows(result, count=None):
+    """True if `result` is a list of dict rows without errors, of length `count` if given."""
+    return (
+        isinstance(result, list)
+        and (count is None or len(result) == count)
+        and all(isinstance(row, dict) and 'error' not in row for row in result)
+    )
+
+def is_single_row(result, key, value):
+    """True if `result` is a list holding a single row whose `key` is `value`."""
+    return is_dict_rows(result, 1) and result[0].get(key) == value
+
+def _header(text, ansi_color):
+    return "\033[%dm%s\033[0m" % (ansi_color, text) if use_color else text
+
+# result headers are built once, ANSI colour codes: green, red, yellow, blue, magenta
+_passed_header = _header("[PASSED] ", 32)
+_failed_header = _header("[FAILED] ", 31)
+_server_mode_header = _header("[SERVER MODE]", 33)
+_magic_header = _header("[MAGIC EXT]", 34)
+_async_header = _header("[ASYNC]", 35)
+
+def print_test_result(test_name, condition=True, server_mode=False, is_ipython=False, is_async=False, result=None):
+    headers = [_passed_header if condition else _failed_header]
     
     if server_mode:
-        headers.append(colored("[SERVER MODE]", 'yellow'))
+        headers.append(_server_mode_header)
     if is_ipython:
-        headers.append(colored("[MAGIC EXT]", 'blue'))
+        headers.append(_magic_header)
     if is_async:
-        headers.append(colored("[ASYNC]", 'magenta'))
+        headers.append(_async_header)
     
     headers.append(test_name)
     message = " ".join(headers)
     
-    print("\n" + message)
+    logger.info("\n" + message)
+    if result is not None:
+        logger.debug("RESULT:\n%s", result)